@@ -2,13 +2,19 @@
 import streamlit as st
 import os
 import json
-import datetime
-import pytz
+import orjson
 import re
+import hashlib
+import functools
+import html
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from google import genai
 from google.genai import types
 from mistralai import Mistral
 from groq import Groq
+import httpx
 import streamlit.components.v1 as components
 from dotenv import load_dotenv
 
@@ -25,10 +31,11 @@ st.set_page_config(
 
 
 # --- Helper: Secrets Management (Local vs Streamlit Cloud) ---
+@functools.lru_cache(maxsize=None)
 def get_secret(key):
     """
     Retrieves secret from Streamlit secrets (Cloud) or os.environ (Local).
-    Prioritizes Streamlit secrets.
+    Prioritizes Streamlit secrets. Looked up once per key per process.
     """
     # 1. Try Streamlit Secrets
     try:
@@ -41,7 +48,37 @@ def get_secret(key):
     return os.environ.get(key)
 
 # --- LLM Ensemble Class ---
+# SDK-level HTTP timeouts (seconds): a hung connect can't block a worker forever
+CONNECT_TIMEOUT = 2.0
+READ_TIMEOUT = 20.0
+
+# Wall-clock budgets for a whole generate_content call (seconds)
+ORACLE_TIMEOUT = 8.0
+GHOST_TIMEOUT = 20.0
+
+# Provider models, in priority order
+GEMINI_MODEL = "gemini-2.0-flash"
+MISTRAL_MODEL = "mistral-large-latest"
+GROQ_MODEL = "llama-3.3-70b-versatile"
+
+# Circuit breaker: after N consecutive failures a provider is skipped for T seconds
+BREAKER_THRESHOLD = 3
+BREAKER_COOLDOWN = 60.0
+
+# Race pool size, shared by every session: room for 8 concurrent 3-provider races,
+# plus calls that outlived their budget and are still draining
+LLM_WORKERS = 24
+
+# Lifetime of the Ghost Writer's provider-side prompt cache (seconds)
+GHOST_CACHE_TTL = 3600
+
 class LLMEnsemble:
+    __slots__ = (
+        "gemini_key", "mistral_key", "groq_key",
+        "gemini_client", "mistral_client", "groq_client",
+        "http_client", "_executor", "_breaker",
+    )
+
     def __init__(self):
         self.gemini_key = get_secret("GOOGLE_API_KEY")
         self.mistral_key = get_secret("MISTRAL_API_KEY")
@@ -51,12 +88,30 @@ class LLMEnsemble:
         self.mistral_client = None
         self.groq_client = None
 
+        # Worker threads for racing the providers against each other
+        self._executor = ThreadPoolExecutor(max_workers=LLM_WORKERS, thread_name_prefix="llm")
+
+        # Per-provider circuit breaker state (lives as long as the cached ensemble)
+        self._breaker = {
+            name: {"fails": 0, "open_until": 0.0} for name in ("Gemini", "Mistral", "Groq")
+        }
+
         self._init_clients()
 
     def _init_clients(self):
+        # One pooled HTTP client shared by the Mistral and Groq SDKs
+        self.http_client = httpx.Client(
+            http2=True,
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_keepalive_connections=20)
+        )
+
         if self.gemini_key:
             try:
-                self.gemini_client = genai.Client(api_key=self.gemini_key)
+                self.gemini_client = genai.Client(
+                    api_key=self.gemini_key,
+                    http_options=types.HttpOptions(timeout=int(READ_TIMEOUT * 1000))
+                )
             except Exception as e:
                 st.error(f"Gemini Init Error: {e}")
         else:
@@ -64,90 +119,189 @@ class LLMEnsemble:
         
         if self.mistral_key:
             try:
-                self.mistral_client = Mistral(api_key=self.mistral_key)
+                self.mistral_client = Mistral(
+                    api_key=self.mistral_key,
+                    client=self.http_client,
+                    timeout_ms=int(READ_TIMEOUT * 1000)
+                )
             except Exception as e:
                 st.error(f"Mistral Init Error: {e}")
         
         if self.groq_key:
             try:
-                self.groq_client = Groq(api_key=self.groq_key)
+                self.groq_client = Groq(
+                    api_key=self.groq_key,
+                    http_client=self.http_client,
+                    timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT)
+                )
             except Exception as e:
                 st.error(f"Groq Init Error: {e}")
 
-    def generate_content(self, prompt, system_instruction=None, json_mode=False):
+    def circuit_open(self, name):
+        return time.monotonic() < self._breaker[name]["open_until"]
+
+    def create_prompt_cache(self, system_instruction, ttl_seconds=GHOST_CACHE_TTL):
+        """
+        Uploads a long, static system instruction to Gemini's context cache so
+        later calls only send the new user turn. The upload runs on the race
+        pool, so no request ever waits for it.
+        Returns: Future of the cache name for generate_content(cached_content=...)
+        (None on failure), or None if Gemini is unavailable.
+        """
+        if not self.gemini_client or not system_instruction or self.circuit_open("Gemini"):
+            return None
+        return self._executor.submit(self._create_prompt_cache, system_instruction, ttl_seconds)
+
+    def _create_prompt_cache(self, system_instruction, ttl_seconds):
+        try:
+            cache = self.gemini_client.caches.create(
+                model=GEMINI_MODEL,
+                config=types.CreateCachedContentConfig(
+                    system_instruction=system_instruction,
+                    ttl=f"{int(ttl_seconds)}s"
+                )
+            )
+            return cache.name
+        except Exception:
+            return None # e.g. prompt below the provider's minimum cacheable size
+
+    def _generate_gemini(self, prompt, system_instruction, json_mode, cached_content):
+        if cached_content:
+            # The system instruction already lives in the cached prefix
+            system_instruction = None
+        config = types.GenerateContentConfig(
+            response_mime_type="application/json" if json_mode else "text/plain",
+            system_instruction=system_instruction,
+            cached_content=cached_content
+        )
+        response = self.gemini_client.models.generate_content(
+            model=GEMINI_MODEL,
+            contents=prompt,
+            config=config
+        )
+        return response.text, "Gemini 2.0 Flash"
+
+    def _generate_mistral(self, messages, response_format):
+        chat_response = self.mistral_client.chat.complete(
+            model=MISTRAL_MODEL,
+            messages=messages,
+            response_format=response_format
+        )
+        return chat_response.choices[0].message.content, "Mistral Large"
+
+    def _generate_groq(self, messages, response_format):
+        chat_completion = self.groq_client.chat.completions.create(
+            messages=messages,
+            model=GROQ_MODEL,
+            response_format=response_format
+        )
+        return chat_completion.choices[0].message.content, "Groq Llama 3"
+
+    def _record_failure(self, name):
+        breaker = self._breaker[name]
+        breaker["fails"] += 1
+        if breaker["fails"] >= BREAKER_THRESHOLD:
+            breaker["open_until"] = time.monotonic() + BREAKER_COOLDOWN
+
+    def _record_success(self, name):
+        self._breaker[name] = {"fails": 0, "open_until": 0.0}
+
+    def generate_content(self, prompt, system_instruction=None, json_mode=False, call_timeout=ORACLE_TIMEOUT, cached_content=None):
         """
-        Tries to generate content using Gemini -> Mistral -> Groq.
+        Races Gemini, Mistral and Groq concurrently and returns the first success.
+        A slow or failing provider no longer delays the others, and the whole
+        call gives up after `call_timeout` seconds. `cached_content` (from
+        create_prompt_cache) lets Gemini skip re-sending the system instruction.
         Returns: (text_response, source_model_name)
         """
         errors = []
+        deadline = time.monotonic() + call_timeout
+
+        # Chat-style payload shared by Mistral and Groq
+        messages = [{"role": "system", "content": system_instruction}] if system_instruction else []
+        messages.append({"role": "user", "content": prompt})
+        response_format = {"type": "json_object"} if json_mode else None
+
+        # Dispatch every configured provider at once (priority order kept for ties)
+        providers = [
+            ("Gemini", self.gemini_client, self._generate_gemini, (prompt, system_instruction, json_mode, cached_content)),
+            ("Mistral", self.mistral_client, self._generate_mistral, (messages, response_format)),
+            ("Groq", self.groq_client, self._generate_groq, (messages, response_format)),
+        ]
+        futures = {}
+        for name, client, call, args in providers:
+            if not client:
+                continue
+            # Skip providers whose circuit is open instead of paying their timeout again
+            if self.circuit_open(name):
+                errors.append(f"{name} skipped: circuit open after repeated failures")
+                continue
+            future = self._executor.submit(call, *args)
+            futures[future] = name
+        priority = list(futures)
+
+        pending = set(futures)
+        while pending:
+            remaining = max(deadline - time.monotonic(), 0)
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            if not done:
+                # Budget exhausted: give up on whoever is still running
+                for future in sorted(pending, key=priority.index):
+                    if future.cancel():
+                        # Still queued behind other sessions' calls: the provider
+                        # was never asked, so it isn't charged to its breaker
+                        errors.append(f"{futures[future]} not started within {call_timeout}s (pool busy)")
+                        continue
+                    errors.append(f"{futures[future]} timed out after {call_timeout}s")
+                    self._record_failure(futures[future])
+                break
+
+            for future in sorted(done, key=priority.index):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    errors.append(f"{futures[future]} failed: {e}")
+                    self._record_failure(futures[future])
+                    continue
 
-        # 1. Try Gemini
-        if self.gemini_client:
-            try:
-                model_name = "gemini-2.0-flash"
-                config = types.GenerateContentConfig(
-                    response_mime_type="application/json" if json_mode else "text/plain",
-                    system_instruction=system_instruction
-                )
-                response = self.gemini_client.models.generate_content(
-                    model=model_name,
-                    contents=prompt,
-                    config=config
-                )
-                return response.text, "Gemini 2.0 Flash"
-            except Exception as e:
-                errors.append(f"Gemini failed: {e}")
+                self._record_success(futures[future])
 
-        # 2. Try Mistral
-        if self.mistral_client:
-            try:
-                model_name = "mistral-large-latest"
-                messages = []
-                if system_instruction:
-                    messages.append({"role": "system", "content": system_instruction})
-                messages.append({"role": "user", "content": prompt})
-                
-                response_format = {"type": "json_object"} if json_mode else None
-                
-                chat_response = self.mistral_client.chat.complete(
-                    model=model_name,
-                    messages=messages,
-                    response_format=response_format
-                )
-                return chat_response.choices[0].message.content, "Mistral Large"
-            except Exception as e:
-                errors.append(f"Mistral failed: {e}")
+                # Winner found: drop the losers that haven't started yet
+                for loser in pending:
+                    loser.cancel()
+                return result
 
-        # 3. Try Groq
-        if self.groq_client:
-            try:
-                model_name = "llama-3.3-70b-versatile"
-                messages = []
-                if system_instruction:
-                    messages.append({"role": "system", "content": system_instruction})
-                messages.append({"role": "user", "content": prompt})
-
-                response_format = {"type": "json_object"} if json_mode else None
-
-                chat_completion = self.groq_client.chat.completions.create(
-                    messages=messages,
-                    model=model_name,
-                    response_format=response_format
-                )
-                return chat_completion.choices[0].message.content, "Groq Llama 3"
-            except Exception as e:
-                errors.append(f"Groq failed: {e}")
-        
         # If all fail
         return json.dumps({"error": "All LLMs failed", "details": errors}) if json_mode else f"System Malfunction. All AI Cores Unresponsive. Errors: {errors}", "None"
 
-# Initialize Ensemble
-llm_ensemble = LLMEnsemble()
+# Initialize Ensemble (cached so clients and their connection pools survive reruns)
+@st.cache_resource
+def get_ensemble():
+    return LLMEnsemble()
+
+llm_ensemble = get_ensemble()
+
+@st.cache_resource(ttl=GHOST_CACHE_TTL - 60, show_spinner=False)
+def shared_prompt_cache(instruction_hash, _system_instruction):
+    """
+    One Gemini prompt cache per distinct Ghost Writer prompt, shared by every
+    session (keyed on the prompt's hash) and renewed shortly before the
+    provider-side copy expires. A failed upload (e.g. a prompt below the
+    minimum cacheable size) is only retried after the TTL.
+    Returns the create_prompt_cache Future.
+    """
+    return llm_ensemble.create_prompt_cache(_system_instruction)
+
+def ghost_cache_name(instruction_hash, system_instruction):
+    """Cache name if the shared upload has finished, else None (send the full prompt)."""
+    if not llm_ensemble or llm_ensemble.circuit_open("Gemini"):
+        return None
+    future = shared_prompt_cache(instruction_hash, system_instruction)
+    return future.result() if future and future.done() else None
 
 
 # --- Custom CSS (Glassmorphism & Futuristic UI) ---
-def render_css():
-    st.markdown("""
+APP_CSS = """
         <style>
         /* General App Styling */
         .stApp {
@@ -264,7 +418,10 @@ def render_css():
         }
         
         </style>
-    """, unsafe_allow_html=True)
+    """
+
+def render_css():
+    st.markdown(APP_CSS, unsafe_allow_html=True)
 
 render_css()
 
@@ -281,32 +438,14 @@ if 'ghost_messages' not in st.session_state:
     st.session_state.ghost_messages = []
 
 
-# --- Helper Functions ---
-@st.cache_data
-def load_memories():
-    try:
-        with open('assets/memories.json', 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return []
-
-@st.cache_data
-def load_chat_history():
-    try:
-        with open('whatsapp_chat.txt', 'r', encoding='utf-8') as f:
-            # OPTIMIZATION: Read only the last 15,000 characters to prevent Context Window overflow
-            text = f.read()
-            return text[-15000:] 
-    except FileNotFoundError:
-        return ""
-
-
 # --- Security Layer (Rate Limiting & Anti-Automation) ---
 class SecurityLayer:
+    __slots__ = () # All state lives in st.session_state
+
     def __init__(self):
         # Persistent storage for failed attempts (Global)
         if 'failed_attempts' not in st.session_state:
-            st.session_state.failed_attempts = [] # List of timestamps
+            st.session_state.failed_attempts = deque(maxlen=10) # Monotonic timestamps
         
         # Last request timestamp for automation check (Session-based)
         if 'last_request_time' not in st.session_state:
@@ -316,7 +455,7 @@ class SecurityLayer:
         """
         Discourage automation: Reject requests < 0.5s apart.
         """
-        current_time = datetime.datetime.now().timestamp()
+        current_time = time.monotonic()
         last_time = st.session_state.last_request_time
         
         # Update last request time
@@ -331,36 +470,57 @@ class SecurityLayer:
         Global-ish Rate Limit: Max 10 failed attempts per hour per session.
         (Note: In a real app this would be IP based via DB/Redis)
         """
-        now = datetime.datetime.now()
-        # Filter attempts within the last hour
-        st.session_state.failed_attempts = [t for t in st.session_state.failed_attempts if (now - t).total_seconds() < 3600]
+        now = time.monotonic()
+        attempts = st.session_state.failed_attempts
+        # Drop attempts older than an hour (oldest sit at the left)
+        while attempts and now - attempts[0] >= 3600:
+            attempts.popleft()
         
-        if len(st.session_state.failed_attempts) >= 10:
+        if len(attempts) >= 10:
             return False, "System Locked. Too many attempts. Try again later."
         return True, ""
 
     def log_failure(self):
         """Log a failed attempt timestamp."""
-        st.session_state.failed_attempts.append(datetime.datetime.now())
+        st.session_state.failed_attempts.append(time.monotonic())
 
 security = SecurityLayer()
 
 
 # --- Decryption Service ---
-from cryptography.fernet import Fernet
+from vault_crypto import VaultCipher
 import io
 
 @st.cache_resource
 def get_cipher():
     key = get_secret("VAULT_KEY")
     if key:
-        return Fernet(key)
+        return VaultCipher(key)
     return None
 
-def decrypt_data(file_path, is_json=False, is_text=False):
+@st.cache_data(max_entries=32, show_spinner=False)
+def decrypt_file(enc_path, mtime):
+    """
+    Decrypted bytes of an .enc file.
+    `mtime` is only part of the cache key: re-encrypting a file invalidates it.
+    """
+    out = io.BytesIO()
+    with open(enc_path, "rb") as f:
+        get_cipher().decrypt_stream(f, out)
+    return out.getvalue()
+
+# Only the last 15,000 characters of the chat are used, to prevent Context Window overflow
+CHAT_TAIL_CHARS = 15000
+
+def tail_text(data, tail):
+    """Decodes only the last `tail` characters of UTF-8 bytes (at most 4 bytes per char)."""
+    return data[-(tail + 1) * 4:].decode('utf-8', errors='ignore')[-tail:]
+
+def decrypt_data(file_path, is_json=False, is_text=False, tail=None):
     """
     Decrypts a file and returns its content.
     If VAULT_KEY is invalid or file not encrypted, tries to read as plain text backup.
+    With `tail`, text files return only their last `tail` characters.
     """
     cipher = get_cipher()
     
@@ -369,13 +529,14 @@ def decrypt_data(file_path, is_json=False, is_text=False):
     
     if os.path.exists(enc_path) and cipher:
         try:
-            with open(enc_path, "rb") as f:
-                encrypted_data = f.read()
-            decrypted_data = cipher.decrypt(encrypted_data)
+            decrypted_data = decrypt_file(enc_path, os.path.getmtime(enc_path))
             
             if is_json:
-                return json.loads(decrypted_data.decode('utf-8'))
+                return orjson.loads(decrypted_data)
             if is_text:
+                if tail:
+                    # The whole file is decrypted, but only the tail gets decoded
+                    return tail_text(decrypted_data, tail)
                 return decrypted_data.decode('utf-8')
             return decrypted_data # Return bytes for media
             
@@ -386,7 +547,13 @@ def decrypt_data(file_path, is_json=False, is_text=False):
     # Fallback: Read plaintext file (for local dev or if not encrypted)
     if os.path.exists(file_path):
         if is_json:
-            with open(file_path, 'r') as f: return json.load(f)
+            with open(file_path, 'rb') as f: return orjson.loads(f.read())
+        if is_text and tail:
+            # Seek straight to the tail instead of reading the whole file
+            with open(file_path, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                f.seek(max(0, f.tell() - (tail + 1) * 4))
+                return tail_text(f.read(), tail)
         if is_text:
             with open(file_path, 'r', encoding='utf-8') as f: return f.read()
         with open(file_path, 'rb') as f: return f.read()
@@ -400,12 +567,139 @@ def load_memories():
     return data if data else []
 
 @st.cache_data
-def load_chat_history():
-    # Only read last 15000 chars even from encrypted data
-    text = decrypt_data('whatsapp_chat.txt', is_text=True)
-    if text:
-        return text[-15000:]
-    return ""
+def load_memories_digest():
+    """
+    Compact, index-tagged view of the memories for the Oracle prompt.
+    The LLM only sees short summaries and answers with an index.
+    Returns: (digest_json, digest_hash)
+    """
+    digest = [
+        {"i": i, "summary": (m.get("summary") or m.get("description") or json.dumps(m))[:120]}
+        for i, m in enumerate(load_memories())
+    ]
+    digest_bytes = orjson.dumps(digest)
+    return digest_bytes.decode('utf-8'), hashlib.blake2b(digest_bytes).hexdigest()
+
+def memory_file_path(memories, result):
+    """Resolves the Oracle's memory_index to the chosen memory's file path."""
+    try:
+        index = int(result.get("memory_index"))
+    except (TypeError, ValueError):
+        return ""
+    if not 0 <= index < len(memories):
+        return ""
+    memory = memories[index]
+    return memory.get("file_path") or memory.get("file", "")
+
+CHAT_PATH = "whatsapp_chat.txt"
+
+def artifact_mtime(file_path):
+    """mtime of the file the vault would read (the .enc if present, else plaintext), or 0."""
+    for path in (file_path + ".enc", file_path):
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            continue
+    return 0.0
+
+@st.cache_data(show_spinner=False)
+def load_chat_history(mtime):
+    """
+    Last CHAT_TAIL_CHARS of the chat transcript.
+    `mtime` is only part of the cache key, so re-running encrypt_vault.py refreshes it.
+    """
+    text = decrypt_data(CHAT_PATH, is_text=True, tail=CHAT_TAIL_CHARS)
+    return text if text else ""
+
+# Oracle prompt scaffolding, built once at import and filled per request
+ORACLE_INTRO = "You are the magical curator of a couple's love story."
+ORACLE_SPANISH_NOTE = " The user speaks Spanish. Analyze the mood in Spanish context, but the memories are in English. The final poetic message MUST be in Spanish (Latin American)."
+
+ORACLE_PROMPT = """
+{intro_prompt}
+User ({user}) is feeling: '{mood}'.
+Target Persona (Author of message): {persona}.
+
+Here are the available memories (index "i" and a short summary):
+{memories}
+
+Task:
+1. Analyze the user's mood ('{mood}') deeply.
+2. Select the ONE memory from the provided list that BEST resonates with this mood. Do NOT just pick the first one.
+3. Write a short, poetic, loving message.
+
+Return STRICT JSON format:
+{{
+    "reasoning": "Why I chose this memory for this mood...",
+    "memory_index": 0,
+    "poetic_message": "Your message here..."
+}}
+"""
+
+class OracleGibberishError(Exception):
+    """The Oracle's reply wasn't a JSON object."""
+    def __init__(self, response_text, model_used):
+        super().__init__(response_text)
+        self.response_text = response_text
+        self.model_used = model_used
+
+MOOD_WORD_RE = re.compile(r"\w+")
+
+def normalize_mood(mood):
+    """
+    Oracle cache key for a mood: ignores case, punctuation and spacing.
+    Moods with no word characters (emoji, ":(") keep their raw text, so they
+    never collapse into one shared empty key.
+    """
+    return " ".join(MOOD_WORD_RE.findall(mood.casefold())) or mood.strip() or mood
+
+@st.cache_data(ttl=86400, show_spinner=False)
+def cached_oracle(mood_key, user, persona, digest_hash, _digest_json, _mood):
+    """
+    Asks the ensemble which memory best fits the mood.
+    Cached on (normalized mood, user, persona, digest_hash), so reruns and
+    near-identical moods ("Sad", "sad!") skip the LLM round trip. The
+    underscore args are not hashed by Streamlit: `digest_hash` stands in for
+    `_digest_json`, and the raw `_mood` is only used to build the prompt.
+    Returns: {"result": parsed JSON dict, "model_used": ...}
+    """
+    # Language-aware prompt
+    intro_prompt = ORACLE_INTRO
+    if user == "Anghily":
+        intro_prompt += ORACLE_SPANISH_NOTE
+
+    prompt = ORACLE_PROMPT.format(
+        intro_prompt=intro_prompt,
+        user=user,
+        mood=_mood,
+        persona=persona,
+        memories=_digest_json
+    )
+
+    response_text, model_used = llm_ensemble.generate_content(
+        prompt=prompt,
+        json_mode=True,
+        call_timeout=ORACLE_TIMEOUT
+    )
+
+    # Don't cache an outage or gibberish: raising skips the cache write
+    if model_used == "None":
+        raise RuntimeError(response_text)
+    try:
+        result = orjson.loads(response_text)
+    except orjson.JSONDecodeError:
+        result = None
+    if not isinstance(result, dict):
+        raise OracleGibberishError(response_text, model_used)
+
+    # Parsed once here, so cache hits skip JSON decoding entirely
+    return {"result": result, "model_used": model_used}
+
+
+def render_bubble(role, content):
+    """HTML for one Ghost Writer chat bubble (escaping is cheaper than any cache lookup)."""
+    color = '#fff' if role == 'assistant' else '#aaa'
+    return f"<span style='color: {color}; white-space: pre-wrap;'>{html.escape(content or '')}</span>"
 
 
 # --- Translations & Bilingual Support ---
@@ -448,6 +742,18 @@ def get_text(key):
     return TRANSLATIONS[lang].get(key, key)
 
 
+# Separators and ordinal suffixes stripped to build a date "fingerprint"
+DATE_STRIP_RE = re.compile(r'st|nd|rd|th|/|-|\.|,|\s')
+
+# Fingerprints that resolve to "1st Jan 2026" (incl. 1.1.26, 26.1.1 and YYYY/MM/DD formats)
+VALID_FINGERPRINTS = frozenset({
+    "1jan2026", "1jan26", "jan12026", "jan126",
+    "01012026", "010126", "1126", "112026",
+    "260101", "20260101", "2611", "202611"
+})
+FINGERPRINT_MIN_LEN = min(map(len, VALID_FINGERPRINTS))
+FINGERPRINT_MAX_LEN = max(map(len, VALID_FINGERPRINTS))
+
 def parser_date_input(input_str):
     """
     Robustly parses flexible date strings into (YYYY, MM, DD) tuple.
@@ -455,6 +761,15 @@ def parser_date_input(input_str):
     """
     if not input_str:
         return None
+
+    # We strip common separators to create a "fingerprint"
+    # (every valid fingerprint already contains the year and Jan/01/1)
+    clean = DATE_STRIP_RE.sub('', input_str.lower().strip())
+
+    # Partial or malformed keys aren't attempts: bail out before the security
+    # checks so they neither run nor count towards the lockout
+    if not (FINGERPRINT_MIN_LEN <= len(clean) <= FINGERPRINT_MAX_LEN and clean.isalnum()):
+        return None
     
     # 1. Anti-Automation Check
     is_human, auth_msg = security.check_automation()
@@ -468,30 +783,7 @@ def parser_date_input(input_str):
         st.error(limit_msg)
         return None
 
-    input_str = input_str.lower().strip()
-    
-    # Check for Year 2026 (Mandatory)
-    if "26" not in input_str:
-        security.log_failure()
-        return None
-        
-    # Check for Jan/01/1 (Mandatory)
-    if not any(x in input_str for x in ["jan", "01", "1"]):
-        security.log_failure()
-        return None
-        
-    # Valid patterns that resolve to "1st Jan 2026"
-    # We strip common separators to create a "fingerprint"
-    clean = re.sub(r'st|nd|rd|th|/|-|\.|,|\s', '', input_str)
-    
-    # Expanded Fingerprints for 1.1.26, 26.1.1, etc.
-    valid_fingerprints = [
-        "1jan2026", "1jan26", "jan12026", "jan126",
-        "01012026", "010126", "1126", "112026", 
-        "260101", "20260101", "2611", "202611" # For YYYY/MM/DD formats
-    ]
-    
-    if clean in valid_fingerprints:
+    if clean in VALID_FINGERPRINTS:
         return True
     
     # Log failure if regex matches didn't pass
@@ -499,10 +791,8 @@ def parser_date_input(input_str):
     return False
 
 # --- State 1: The Cover (The Trojan Horse) ---
-def render_cover():
-    
-    # Premium Dashboard Header with Glitch Effect
-    st.markdown("""
+# Static header markup lives in a module constant so reruns don't rebuild the string
+COVER_HEADER_HTML = """
         <div style="text-align: center; margin-bottom: 40px; position: relative;">
             <div style="font-size: 0.9rem; letter-spacing: 6px; color: #00d2ff; text-transform: uppercase; margin-bottom: 10px; text-shadow: 0 0 10px rgba(0,210,255,0.5);">Secure Vault System</div>
             <h1 style="font-size: 4.5rem; letter-spacing: 12px; margin: 0; background: linear-gradient(to bottom, #fff, #aaa); -webkit-background-clip: text; -webkit-text-fill-color: transparent; text-shadow: 0 0 30px rgba(255,255,255,0.3);">NUESTRA BÓVEDA</h1>
@@ -511,224 +801,21 @@ def render_cover():
                 <span style="border: 1px solid #333; padding: 5px 10px; border-radius: 4px;">PROTOCOL: <span style="color: #00d2ff;">V.9.0</span></span>
             </div>
         </div>
-    """, unsafe_allow_html=True)
-    
-    
-    # CLIENT-SIDE JS CLOCK & DASHBOARD VISUALS (Added Delhi, 3D Canvas)
-    dashboard_html = """
-    <!DOCTYPE html>
-    <html>
-    <head>
-    <style>
-        body { margin: 0; background: transparent; font-family: 'Inter', sans-serif; overflow: hidden; }
-        
-        .container {
-            display: flex;
-            justify-content: center;
-            gap: 20px;
-            align-items: center;
-            flex-wrap: wrap;
-        }
-
-        .clock-card {
-            background: rgba(0, 10, 20, 0.8);
-            border: 1px solid rgba(0, 210, 255, 0.3);
-            border-radius: 8px;
-            width: 140px;
-            padding: 15px;
-            text-align: center;
-            position: relative;
-            box-shadow: 0 0 20px rgba(0,0,0,0.8), inset 0 0 20px rgba(0, 210, 255, 0.05);
-            transition: all 0.3s ease;
-        }
-        
-        .clock-card:hover {
-            border-color: #00d2ff;
-            box-shadow: 0 0 30px rgba(0, 210, 255, 0.4);
-            transform: scale(1.05);
-        }
-        
-        .clock-card::after {
-            content: '';
-            position: absolute;
-            bottom: 0; left: 20%; right: 20%; height: 2px;
-            background: #00d2ff;
-            box-shadow: 0 0 10px #00d2ff;
-        }
-
-        .city { 
-            font-size: 0.7rem; 
-            color: #00d2ff; 
-            margin-bottom: 5px; 
-            text-transform: uppercase; 
-            letter-spacing: 2px;
-            font-weight: 600;
-        }
-        
-        .time { 
-             font-family: 'Courier New', monospace;
-            font-size: 1.5rem; 
-            font-weight: 700; 
-            color: #fff;
-            text-shadow: 0 0 10px rgba(0, 210, 255, 0.8);
-        }
-        
-        .date { font-size: 0.6rem; color: #555; margin-top: 5px; text-transform: uppercase; }
-
-        /* Fake Graph CSS */
-        .graph-container {
-            display: flex;
-            justify-content: space-between;
-            margin-top: 40px;
-            padding: 0 20px;
-        }
-        .stat-block {
-            flex: 1;
-            height: 80px;
-            background: rgba(0,0,0,0.5);
-            border: 1px solid #222;
-            border-radius: 4px;
-            position: relative;
-            overflow: hidden;
-            margin: 0 10px;
-        }
-        
-        /* Laser Beam Animation */
-        .laser-beam {
-            position: absolute;
-            top: 50%; left: 0; width: 100%; height: 2px;
-            background: red;
-            box-shadow: 0 0 10px red;
-            opacity: 0.5;
-            animation: laserScan 3s infinite linear;
-        }
-        @keyframes laserScan {
-            0% { top: 10%; opacity: 0; }
-            10% { opacity: 1; }
-            90% { opacity: 1; }
-            100% { top: 90%; opacity: 0; }
-        }
-        
-        .stat-label {
-            position: absolute;
-            top: 5px; left: 5px;
-            font-size: 0.5rem; color: #00d2ff; letter-spacing: 1px;
-        }
-
-    </style>
-    </head>
-    <body>
-        <div class="container">
-            <div class="clock-card">
-                <div class="city">Montreal</div>
-                <div class="time" id="time-montreal">--:--:--</div>
-                <div class="date" id="date-montreal"></div>
-            </div>
-            <div class="clock-card">
-                <div class="city">Paris</div>
-                <div class="time" id="time-paris">--:--:--</div>
-                <div class="date" id="date-paris"></div>
-            </div>
-            <div class="clock-card">
-                <div class="city">Dubai</div>
-                <div class="time" id="time-dubai">--:--:--</div>
-                <div class="date" id="date-dubai"></div>
-            </div>
-             <div class="clock-card">
-                <div class="city">Delhi</div>
-                <div class="time" id="time-delhi">--:--:--</div>
-                <div class="date" id="date-delhi"></div>
-            </div>
-            <div class="clock-card">
-                <div class="city">Beijing</div>
-                <div class="time" id="time-beijing">--:--:--</div>
-                <div class="date" id="date-beijing"></div>
-            </div>
-        </div>
+    """
 
-        <div class="graph-container">
-             <div class="stat-block">
-                <div class="stat-label">QUANTUM MEMORY LINK</div>
-                <canvas id="canvas1" style="width: 100%; height: 100%;"></canvas>
-             </div>
-             <div class="stat-block">
-                 <div class="laser-beam"></div>
-                <div class="stat-label">BIOMETRIC SCAN</div>
-             </div>
-             <div class="stat-block">
-                <div class="stat-label">TEMPORAL DRIFT</div>
-                 <canvas id="canvas2" style="width: 100%; height: 100%;"></canvas>
-             </div>
-        </div>
+@st.cache_data
+def load_dashboard_html():
+    """Clock/graph dashboard markup, read once from its static asset."""
+    with open('assets/dashboard.html', 'r', encoding='utf-8') as f:
+        return f.read()
 
-        <script>
-            function updateClocks() {
-                const now = new Date();
-                
-                const options = { hour12: false, hour: '2-digit', minute: '2-digit', second: '2-digit' };
-                const dateOptions = { weekday: 'short', month: 'short', day: 'numeric' };
-
-                // Montreal (America/Montreal)
-                const montrealTime = new Date(now.toLocaleString("en-US", {timeZone: "America/Montreal"}));
-                document.getElementById('time-montreal').textContent = montrealTime.toLocaleTimeString('en-GB', options);
-                document.getElementById('date-montreal').textContent = montrealTime.toLocaleDateString('en-GB', dateOptions);
-
-                // Paris (Europe/Paris)
-                const parisTime = new Date(now.toLocaleString("en-US", {timeZone: "Europe/Paris"}));
-                document.getElementById('time-paris').textContent = parisTime.toLocaleTimeString('en-GB', options);
-                document.getElementById('date-paris').textContent = parisTime.toLocaleDateString('en-GB', dateOptions);
-
-                // Dubai (Asia/Dubai)
-                const dubaiTime = new Date(now.toLocaleString("en-US", {timeZone: "Asia/Dubai"}));
-                document.getElementById('time-dubai').textContent = dubaiTime.toLocaleTimeString('en-GB', options);
-                document.getElementById('date-dubai').textContent = dubaiTime.toLocaleDateString('en-GB', dateOptions);
-
-                // Delhi (Asia/Kolkata)
-                const delhiTime = new Date(now.toLocaleString("en-US", {timeZone: "Asia/Kolkata"}));
-                document.getElementById('time-delhi').textContent = delhiTime.toLocaleTimeString('en-GB', options);
-                document.getElementById('date-delhi').textContent = delhiTime.toLocaleDateString('en-GB', dateOptions);
-
-                // Beijing (Asia/Shanghai)
-                const beijingTime = new Date(now.toLocaleString("en-US", {timeZone: "Asia/Shanghai"}));
-                document.getElementById('time-beijing').textContent = beijingTime.toLocaleTimeString('en-GB', options);
-                document.getElementById('date-beijing').textContent = beijingTime.toLocaleDateString('en-GB', dateOptions);
-            }
-
-            setInterval(updateClocks, 1000);
-            updateClocks();
-            
-            // Simple Sine Wave Animation for Graphs
-            function drawSine(canvasId, speed) {
-                const canvas = document.getElementById(canvasId);
-                const ctx = canvas.getContext('2d');
-                let width = canvas.width = canvas.offsetWidth;
-                let height = canvas.height = canvas.offsetHeight;
-                let phase = 0;
-                
-                function animate() {
-                    ctx.clearRect(0, 0, width, height);
-                    ctx.beginPath();
-                    ctx.moveTo(0, height/2);
-                    for(let i=0; i<width; i++) {
-                        ctx.lineTo(i, height/2 + Math.sin(i * 0.05 + phase) * 20);
-                    }
-                    ctx.strokeStyle = '#00d2ff';
-                    ctx.lineWidth = 1.5;
-                    ctx.stroke();
-                    phase += speed;
-                    requestAnimationFrame(animate);
-                }
-                animate();
-            }
-            
-            drawSine('canvas1', 0.1);
-            drawSine('canvas2', 0.15);
-        </script>
-    </body>
-    </html>
-    """
+def render_cover():
     
-    components.html(dashboard_html, height=450)
+    # Premium Dashboard Header with Glitch Effect
+    st.markdown(COVER_HEADER_HTML, unsafe_allow_html=True)
+    
+    # CLIENT-SIDE JS CLOCK & DASHBOARD VISUALS (Added Delhi, 3D Canvas)
+    components.html(load_dashboard_html(), height=450)
 
     # Input Logic (Minimized and Obscure)
     st.markdown("<br>", unsafe_allow_html=True)
@@ -767,6 +854,45 @@ def render_identity():
             st.rerun()
 
 # --- State 3: The Vault (Main App) ---
+# Oracle result card, filled with str.format_map (values are HTML-escaped by the caller)
+GLASS_CARD_TMPL = """
+<div class='glass-card' style='height: 100%; display: flex; flex-direction: column; justify-content: center; align-items: center;'>
+    <div style='font-size: 1.3rem; font-style: italic; line-height: 1.6; color: #fff; text-shadow: 0 0 10px rgba(255,255,255,0.3);'>
+        "{poetic_message}"
+    </div>
+    <div style='margin-top: 20px; font-size: 0.8rem; color: #00d2ff;'>
+        {ai_model_label}: {model_used}
+    </div>
+    <div style='margin-top: 10px; font-size: 0.7rem; color: #555;'>
+        {selection_logic_label}: {reasoning}
+    </div>
+</div>
+"""
+
+def ghost_prompt():
+    """
+    Ghost Writer persona prompt and its hash, built on the session's first send.
+    It embeds the whole transcript, so Oracle-only sessions never decrypt it.
+    """
+    if "ghost_system_instruction" not in st.session_state:
+        chat_history_text = load_chat_history(artifact_mtime(CHAT_PATH))
+        st.session_state.ghost_system_instruction = f"""
+            You are simulating {st.session_state.target_persona} in a WhatsApp conversation with {st.session_state.current_user}.
+            
+            Here is the COMPLETE chat history between them:
+            {chat_history_text}
+            
+            RULES:
+            1. Analyze the history DEEPLY. Mimic {st.session_state.target_persona}'s exact slang, emoji usage, sentence length, and tone.
+            2. Reply directly to the user's last message.
+            3. Do NOT sound like an AI. Be the person.
+            4. Reply ONLY with the message text.
+            """
+        st.session_state.ghost_instruction_hash = hashlib.blake2b(
+            st.session_state.ghost_system_instruction.encode("utf-8"), digest_size=16
+        ).hexdigest()
+    return st.session_state.ghost_system_instruction, st.session_state.ghost_instruction_hash
+
 def render_vault():
     st.markdown(f"<div style='text-align: center; margin-bottom: 20px;'><span style='color: #00d2ff; letter-spacing: 2px;'>{get_text('auth_user')}:</span> <span style='color: #fff; font-weight: bold;'>{st.session_state.current_user.upper()}</span></div>", unsafe_allow_html=True)
     
@@ -787,75 +913,52 @@ def render_vault():
                     st.error(get_text("memory_empty"))
                 else:
                     try:
-                        # Language-aware prompt
-                        intro_prompt = "You are the magical curator of a couple's love story."
-                        if st.session_state.current_user == "Anghily":
-                             intro_prompt += " The user speaks Spanish. Analyze the mood in Spanish context, but the memories are in English. The final poetic message MUST be in Spanish (Latin American)."
-                        
-                        prompt = f"""
-                        {intro_prompt}
-                        User ({st.session_state.current_user}) is feeling: '{mood}'.
-                        Target Persona (Author of message): {st.session_state.target_persona}.
-                        
-                        Here are the available memories:
-                        {json.dumps(memories)}
-                        
-                        Task:
-                        1. Analyze the user's mood ('{mood}') deeply.
-                        2. Select the ONE memory from the provided list that BEST resonates with this mood. Do NOT just pick the first one.
-                        3. Write a short, poetic, loving message.
-                        
-                        Return STRICT JSON format:
-                        {{
-                            "reasoning": "Why I chose this memory for this mood...",
-                            "file_path": "assets/Filename.ext",
-                            "poetic_message": "Your message here..."
-                        }}
-                        """
-                        
-                        response_text, model_used = llm_ensemble.generate_content(
-                            prompt=prompt,
-                             json_mode=True
-                        )
-                        
+                        digest_json, digest_hash = load_memories_digest()
+
                         try:
-                            result = json.loads(response_text)
+                            oracle = cached_oracle(
+                                normalize_mood(mood),
+                                st.session_state.current_user,
+                                st.session_state.target_persona,
+                                digest_hash,
+                                digest_json,
+                                mood
+                            )
+                            result, model_used = oracle["result"], oracle["model_used"]
                             
                             c1, c2 = st.columns([1, 1])
                             with c1:
                                  # Decrypt and display image/video
-                                 file_path = result.get("file_path", "")
+                                 file_path = memory_file_path(memories, result)
                                  
-                                 # Try to decrypt data
+                                 # Try to decrypt data (kept in memory: plaintext never touches disk)
                                  file_data = decrypt_data(file_path)
                                  
                                  if file_data:
                                      st.markdown(f"<div style='border-radius: 12px; overflow: hidden; box-shadow: 0 0 30px rgba(0,210,255,0.3); border: 1px solid rgba(0,210,255,0.5);'>", unsafe_allow_html=True)
-                                     if file_path.lower().endswith(('.png', '.jpg', '.jpeg')):
+                                     if file_path.lower().endswith(('.jpg', '.jpeg')):
+                                         # Already JPEG: skip Streamlit's PNG re-encode
+                                         st.image(file_data, use_container_width=True, output_format="JPEG")
+                                     elif file_path.lower().endswith('.png'):
                                          st.image(file_data, use_container_width=True)
                                      elif file_path.lower().endswith(('.mp4', '.mov')):
-                                         # Streamlit video needs file path or bytes/io
-                                         st.video(io.BytesIO(file_data))
+                                         # Raw bytes go straight into Streamlit's media storage
+                                         st.video(file_data)
                                      st.markdown("</div>", unsafe_allow_html=True)
                                  else:
                                      st.warning(f"Memory artifact missing or locked: {file_path}")
 
                             with c2:
-                                st.markdown(f"""
-                                <div class='glass-card' style='height: 100%; display: flex; flex-direction: column; justify-content: center; align-items: center;'>
-                                    <div style='font-size: 1.3rem; font-style: italic; line-height: 1.6; color: #fff; text-shadow: 0 0 10px rgba(255,255,255,0.3);'>
-                                        "{result.get('poetic_message', '')}"
-                                    </div>
-                                    <div style='margin-top: 20px; font-size: 0.8rem; color: #00d2ff;'>
-                                        {get_text('ai_model')}: {model_used}
-                                    </div>
-                                    <div style='margin-top: 10px; font-size: 0.7rem; color: #555;'>
-                                        {get_text('selection_logic')}: {result.get('reasoning', 'N/A')}
-                                    </div>
-                                </div>
-                                """, unsafe_allow_html=True)
-                        except json.JSONDecodeError:
-                            st.error(f"Oracle returned gibberish ({model_used}): {response_text}")
+                                # Plain HTML: st.html bypasses the markdown parser
+                                st.html(GLASS_CARD_TMPL.format_map({
+                                    "poetic_message": html.escape(str(result.get('poetic_message', ''))),
+                                    "ai_model_label": get_text('ai_model'),
+                                    "model_used": html.escape(model_used),
+                                    "selection_logic_label": get_text('selection_logic'),
+                                    "reasoning": html.escape(str(result.get('reasoning', 'N/A'))),
+                                }))
+                        except OracleGibberishError as e:
+                            st.error(f"Oracle returned gibberish ({e.model_used}): {e.response_text}")
                             
                     except Exception as e:
                         st.error(get_text("oracle_error").format(e))
@@ -864,47 +967,39 @@ def render_vault():
     with tab2:
         st.markdown(f"<p style='text-align: center; color: #00d2ff; font-family: monospace; letter-spacing: 2px;'>{get_text('ghost_intro')}</p>", unsafe_allow_html=True)
         
-        # Display persistent chat history
+        # Display persistent chat history. Completed messages are plain HTML bubbles,
+        # so st.html skips the markdown parser; live messages use the same renderer
         for msg in st.session_state.ghost_messages:
             with st.chat_message(msg["role"]):
-                st.markdown(f"<span style='color: {'#fff' if msg['role']=='assistant' else '#aaa'};'>{msg['content']}</span>", unsafe_allow_html=True)
+                st.html(render_bubble(msg["role"], msg["content"]))
         
         # Chat Input
         if prompt := st.chat_input(f"Transmit to {st.session_state.target_persona}..."):
             # Add user message to history
             st.session_state.ghost_messages.append({"role": "user", "content": prompt})
             with st.chat_message("user"):
-                st.markdown(prompt)
+                st.html(render_bubble("user", prompt))
             
             # Generate AI Response
             if llm_ensemble:
-                chat_history_text = load_chat_history()
-                
-                system_instruction = f"""
-                You are simulating {st.session_state.target_persona} in a WhatsApp conversation with {st.session_state.current_user}.
-                
-                Here is the COMPLETE chat history between them:
-                {chat_history_text}
-                
-                RULES:
-                1. Analyze the history DEEPLY. Mimic {st.session_state.target_persona}'s exact slang, emoji usage, sentence length, and tone.
-                2. Reply directly to the user's last message.
-                3. Do NOT sound like an AI. Be the person.
-                4. Reply ONLY with the message text.
-                """
-                
                 try:
                     with st.spinner(f"Intercepting neural pathway..."):
-                        
+                        system_instruction, instruction_hash = ghost_prompt()
                         bot_reply, model_used = llm_ensemble.generate_content(
                             prompt=f"User ({st.session_state.current_user}) says: {prompt}",
-                            system_instruction=system_instruction
+                            system_instruction=system_instruction,
+                            call_timeout=GHOST_TIMEOUT,
+                            # The first send starts the shared upload; later sends use it once ready
+                            cached_content=ghost_cache_name(instruction_hash, system_instruction)
                         )
                         
+                        # Gemini's text is None for blocked/empty candidates; never store that
+                        bot_reply = bot_reply or ""
+
                         # Add bot reply to history
                         st.session_state.ghost_messages.append({"role": "assistant", "content": bot_reply})
                         with st.chat_message("assistant"):
-                            st.markdown(bot_reply)
+                            st.html(render_bubble("assistant", bot_reply))
                             st.caption(f"Thought from: {model_used}")
                             
                 except Exception as e:
@@ -1,7 +1,12 @@
 
 import os
+import json
+import hashlib
 from cryptography.fernet import Fernet
 import glob
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from vault_crypto import VaultCipher, CHUNK_SIZE
 
 # 1. Generate or Load Key
 KEY_FILE = "secret.key"
@@ -18,43 +23,160 @@ def load_key():
         print("IMPORTANT: Add this key to your .env file as VAULT_KEY='...'")
         return key
 
-key = load_key()
-cipher = Fernet(key)
-
 # 2. Files to Encrypt
-files_to_encrypt = []
+# Asset types worth encrypting (.enc isn't listed, so ciphertext is never re-encrypted)
+EXT_SET = frozenset({"jpg", "jpeg", "png", "mp4", "mov", "json", "txt"})
+# Text compresses several-fold; media is already compressed, so it's stored raw
+COMPRESS_EXTS = frozenset({"json", "txt"})
+
+def include(name):
+    """Single filter for asset file names: known extension, and not an example file."""
+    _, dot, ext = name.rpartition(".")
+    return bool(dot) and ext.lower() in EXT_SET and "example" not in name
+
+def scan_assets(root):
+    """Recursive os.scandir walk; DirEntry type checks need no extra stat per file."""
+    found = []
+    stack = [root]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue # Missing or unreadable directory: skip it, like os.walk
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file() and include(entry.name):
+                    found.append(entry.path)
+    return found
+
+def find_files():
+    files_to_encrypt = []
+
+    # Chat History
+    if os.path.exists("whatsapp_chat.txt"):
+        files_to_encrypt.append("whatsapp_chat.txt")
+
+    # Asset Files (Images, Videos, JSON)
+    # Recursive search in assets folder
+    files_to_encrypt.extend(scan_assets("assets"))
+
+    return files_to_encrypt
+
+# 3. Incremental Manifest: path -> [mtime_ns, size] of the plaintext last encrypted
+MANIFEST_FILE = ".vault_manifest.json"
+
+def key_id(key):
+    """Short fingerprint of the key, so a new key forces a full re-encrypt."""
+    return hashlib.sha256(key).hexdigest()[:16]
+
+def load_manifest(key):
+    try:
+        with open(MANIFEST_FILE, "r") as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+    if manifest.get("key_id") != key_id(key):
+        return {}
+    return manifest.get("files", {})
+
+def save_manifest(key, files):
+    # Write to a temp file and rename, so a crash never leaves a torn manifest
+    tmp_path = MANIFEST_FILE + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"key_id": key_id(key), "files": files}, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, MANIFEST_FILE)
+
+def file_signature(file_path):
+    stat = os.stat(file_path)
+    return [stat.st_mtime_ns, stat.st_size]
 
-# Chat History
-if os.path.exists("whatsapp_chat.txt"):
-    files_to_encrypt.append("whatsapp_chat.txt")
+def prefetch(paths):
+    """Asks the kernel to start reading each file into the page cache ahead of the workers."""
+    for file_path in paths:
+        try:
+            fd = os.open(file_path, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
 
-# Asset Files (Images, Videos, JSON)
-# Recursive search in assets folder
-for root, dirs, files in os.walk("assets"):
-    for file in files:
-        if file.endswith((".jpg", ".jpeg", ".png", ".mp4", ".mov", ".json", ".txt")):
-            # Skip already encrypted files and example files
-            if not file.endswith(".enc") and "example" not in file:
-                 files_to_encrypt.append(os.path.join(root, file))
+# 4. Encrypt (one file per worker process)
+_CIPHER = None
 
-# 3. Encrypt Loop
-print(f"Found {len(files_to_encrypt)} files to encrypt.")
+def _init_worker(key):
+    """Builds the cipher once per worker process instead of once per file."""
+    global _CIPHER
+    _CIPHER = VaultCipher(key)
 
-for file_path in files_to_encrypt:
+def read_header(enc_file_path, size):
     try:
-        with open(file_path, "rb") as f:
-            data = f.read()
-        
-        encrypted_data = cipher.encrypt(data)
-        
-        enc_file_path = file_path + ".enc"
-        with open(enc_file_path, "wb") as f:
-            f.write(encrypted_data)
-            
-        print(f"Encrypted: {file_path} -> {enc_file_path}")
-        
+        with open(enc_file_path, "rb") as f:
+            return f.read(size)
+    except FileNotFoundError:
+        return None
+
+def encrypt_one(file_path):
+    """Encrypts file_path to file_path + '.enc'. Returns (success, status line)."""
+    enc_file_path = file_path + ".enc"
+    tmp_path = enc_file_path + ".tmp"
+    try:
+        compress = file_path.rpartition(".")[2].lower() in COMPRESS_EXTS
+
+        with open(file_path, "rb", buffering=CHUNK_SIZE) as src:
+            # Output is deterministic, so a matching header means the .enc is already up to date
+            header = _CIPHER.file_header(src, compress)
+            if read_header(enc_file_path, len(header)) == header:
+                return True, f"Unchanged: {file_path}"
+
+            # Stream 1 MiB chunks through AES-GCM instead of loading the whole file
+            with open(tmp_path, "wb", buffering=CHUNK_SIZE) as dst:
+                _CIPHER.encrypt_stream(src, dst, compress=compress, header=header)
+        os.replace(tmp_path, enc_file_path)
+
+        return True, f"Encrypted: {file_path} -> {enc_file_path}"
+
     except Exception as e:
-        print(f"Error encrypting {file_path}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False, f"Error encrypting {file_path}: {e}"
+
+def main():
+    key = load_key()
+    manifest = load_manifest(key)
+
+    # Only new or modified files (or ones whose .enc went missing) need work
+    files_to_encrypt = []
+    signatures = []
+    for file_path in find_files():
+        signature = file_signature(file_path)
+        if manifest.get(file_path) == signature and os.path.exists(file_path + ".enc"):
+            continue
+        files_to_encrypt.append(file_path)
+        signatures.append(signature)
+    print(f"Found {len(files_to_encrypt)} files to encrypt.")
+
+    # Readahead hints run in the background while the pool encrypts (Linux only)
+    if hasattr(os, "posix_fadvise"):
+        threading.Thread(target=prefetch, args=(files_to_encrypt,), daemon=True).start()
+
+    # Files are independent, so spread them across all cores
+    with ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=_init_worker, initargs=(key,)) as executor:
+        results = executor.map(encrypt_one, files_to_encrypt)
+        for file_path, signature, (ok, status) in zip(files_to_encrypt, signatures, results):
+            print(status)
+            if ok:
+                manifest[file_path] = signature
+
+    save_manifest(key, manifest)
+
+    print("\nDONE. You can now commit the .enc files.")
+    print("Run: git add assets/*.enc *.enc")
 
-print("\nDONE. You can now commit the .enc files.")
-print("Run: git add assets/*.enc *.enc")
+if __name__ == "__main__":
+    main()
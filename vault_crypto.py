@@ -0,0 +1,160 @@
+"""
+Vault file format shared by encrypt_vault.py (writer) and app.py (reader).
+
+A .enc file is:  MAGIC | codec | nonce prefix | chunk 0 | chunk 1 | ... | chunk n
+Each chunk is up to CHUNK_SIZE bytes of payload sealed with AES-256-GCM
+(+16 byte tag), so files are encrypted and decrypted in constant memory.
+The nonce prefix is a keyed hash of the sealed payload, so re-encrypting an
+unchanged file yields byte-identical output (no git churn).
+The codec byte says whether the payload is the raw file (b"R") or a zstd
+stream of it (b"Z", used for text assets that compress well).
+Files written by earlier versions (v1 chunked without a codec byte, or plain
+Fernet tokens) are still readable.
+"""
+import base64
+import hashlib
+import io
+import struct
+
+import zstandard as zstd
+from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+MAGIC = b"NBV2"
+MAGIC_V1 = b"NBV1" # Same layout minus the codec byte (always raw)
+CODEC_RAW = b"R"
+CODEC_ZSTD = b"Z"
+NONCE_PREFIX_SIZE = 8 # + 4 byte chunk counter = 12 byte GCM nonce
+CHUNK_SIZE = 1 << 20 # 1 MiB
+TAG_SIZE = 16
+ZSTD_LEVEL = 10
+
+
+def derive_key(vault_key, info=b"nuestra-boveda/aes-gcm"):
+    """Derives a 256-bit subkey (AES key by default) from the (Fernet-format) VAULT_KEY."""
+    return HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=None,
+        info=info
+    ).derive(base64.urlsafe_b64decode(vault_key))
+
+
+def _read_full(stream, size):
+    """Reads exactly `size` bytes unless EOF comes first (zstd readers return short reads)."""
+    data = stream.read(size)
+    while data and len(data) < size:
+        more = stream.read(size - len(data))
+        if not more:
+            break
+        data += more
+    return data
+
+
+class VaultCipher:
+    """
+    Streaming AES-GCM cipher for vault files.
+    Every chunk's nonce is the file's nonce prefix plus its index, and the
+    header plus a "last chunk" flag are authenticated with it, so chunks
+    can't be reordered, swapped between files or truncated unnoticed.
+    """
+
+    def __init__(self, vault_key):
+        self._fernet = Fernet(vault_key) # Legacy .enc files
+        self._aead = AESGCM(derive_key(vault_key))
+        self._nonce_key = derive_key(vault_key, info=b"nuestra-boveda/nonce")
+
+    @staticmethod
+    def _chunk_params(header, counter, last):
+        nonce = header[-NONCE_PREFIX_SIZE:] + struct.pack(">I", counter)
+        return nonce, header + (b"\x01" if last else b"\x00")
+
+    def file_header(self, src, compress=False):
+        """
+        Header for seekable binary stream `src`, read once and rewound.
+        The nonce prefix is a keyed BLAKE2b of the codec plus the exact bytes
+        that get sealed (the zstd output when compressing, so a different level
+        or libzstd build can't reuse a nonce): identical input gives identical
+        ciphertext, and distinct payloads never share a nonce (barring a 64-bit
+        hash collision).
+        """
+        codec = CODEC_ZSTD if compress else CODEC_RAW
+        digest = hashlib.blake2b(codec, key=self._nonce_key, digest_size=NONCE_PREFIX_SIZE)
+        payload = self._payload(src, compress)
+        while chunk := payload.read(CHUNK_SIZE):
+            digest.update(chunk)
+        src.seek(0)
+        return MAGIC + codec + digest.digest()
+
+    @staticmethod
+    def _payload(src, compress):
+        """The byte stream that actually gets sealed for `src`."""
+        if compress:
+            return zstd.ZstdCompressor(level=ZSTD_LEVEL).stream_reader(src, closefd=False)
+        return src
+
+    def encrypt_stream(self, src, dst, compress=False, header=None):
+        """
+        Encrypts seekable binary stream `src` into `dst`, one chunk at a time.
+        With `compress`, the data is zstd-compressed on the fly first.
+        Pass `header` (from file_header) if it's already been computed.
+        """
+        if header is None:
+            header = self.file_header(src, compress)
+        src = self._payload(src, compress)
+
+        dst.write(header)
+
+        counter = 0
+        chunk = _read_full(src, CHUNK_SIZE)
+        while True:
+            # Read ahead one chunk to know whether this one is the last
+            next_chunk = _read_full(src, CHUNK_SIZE)
+            last = not next_chunk
+            nonce, aad = self._chunk_params(header, counter, last)
+            dst.write(self._aead.encrypt(nonce, chunk, aad))
+            if last:
+                return
+            chunk = next_chunk
+            counter += 1
+
+    def decrypt_stream(self, src, dst):
+        """Decrypts binary stream `src` into `dst` (chunked AES-GCM or legacy Fernet)."""
+        magic = src.read(len(MAGIC))
+        if magic == MAGIC:
+            header = magic + src.read(1 + NONCE_PREFIX_SIZE)
+            codec = header[len(MAGIC):len(MAGIC) + 1]
+        elif magic == MAGIC_V1:
+            header = magic + src.read(NONCE_PREFIX_SIZE)
+            codec = CODEC_RAW
+        else:
+            # Fernet tokens aren't seekable or chunked: decrypt in one go
+            dst.write(self._fernet.decrypt(magic + src.read()))
+            return
+
+        if codec == CODEC_ZSTD:
+            with zstd.ZstdDecompressor().stream_writer(dst, closefd=False) as out:
+                self._open_chunks(header, src, out)
+        else:
+            self._open_chunks(header, src, dst)
+
+    def _open_chunks(self, header, src, dst):
+        counter = 0
+        block = _read_full(src, CHUNK_SIZE + TAG_SIZE)
+        while True:
+            next_block = _read_full(src, CHUNK_SIZE + TAG_SIZE)
+            last = not next_block
+            nonce, aad = self._chunk_params(header, counter, last)
+            dst.write(self._aead.decrypt(nonce, block, aad))
+            if last:
+                return
+            block = next_block
+            counter += 1
+
+    def decrypt(self, data):
+        """Decrypts an in-memory .enc payload and returns the plaintext bytes."""
+        out = io.BytesIO()
+        self.decrypt_stream(io.BytesIO(data), out)
+        return out.getvalue()